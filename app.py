@@ -1,14 +1,22 @@
 import os
+import sys
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from fastapi import FastAPI, HTTPException, Request, File, UploadFile
 from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
 import logging
 import re
 from io import BytesIO
 from PIL import Image
-from utils.ieee_generator import generate_ieee_paper
+from utils.ieee_generator import collect_formulas, generate_ieee_paper, generate_latex_formula_image, prune_formula_cache
 from utils.plagiarism_checker import analyze_plagiarism
 
 app = FastAPI()
@@ -22,11 +30,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON responses (plagiarism reports etc.); level 5 trades little ratio for much less CPU than 9
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-LATEX_PATTERN = r"\\[a-zA-Z]+(\{[^}]*\})*"
+# uvicorn worker processes on this host; uvicorn itself reads the same variable
+WEB_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Cores are split between uvicorn workers and each worker's pool, so the two don't multiply out to cores²
+POOL_WORKERS = int(os.getenv("GENERATOR_POOL_WORKERS", max(1, (os.cpu_count() or 1) // WEB_WORKERS)))
+
+# Worker pool for the CPU-bound document build (matplotlib + python-docx hold the GIL).
+# Workers start from a clean forkserver (spawn on Windows) instead of forking a
+# process that already runs torch and anyio threads
+def _new_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=POOL_WORKERS,
+        mp_context=multiprocessing.get_context("spawn" if sys.platform == "win32" else "forkserver"),
+    )
+
+_POOL = _new_pool()
+
+def _replace_broken_pool(broken: ProcessPoolExecutor):
+    # A pool whose worker died (e.g. OOM-killed) rejects all later work, so swap in
+    # a fresh one; concurrent requests that hit the same broken pool replace it once
+    global _POOL
+    if _POOL is broken:
+        logger.warning("Generator pool broke (a worker died); starting a new one")
+        _POOL = _new_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+LATEX_PATTERN = r"\\[a-zA-Z]+(?:\{[^}]*\})*"
+_LATEX_RE = re.compile(LATEX_PATTERN)
 
 # ----------- Data Models -----------
 
@@ -69,6 +106,22 @@ upload_dir = os.path.join(os.getcwd(), "uploads")
 if not os.path.exists(upload_dir):
     os.makedirs(upload_dir)
 
+def save_bytes(path: str, contents: bytes):
+    with open(path, "wb") as f:
+        f.write(contents)
+
+def iter_chunks(buffer: BytesIO, chunk_size: int = 65536):
+    while chunk := buffer.read(chunk_size):
+        yield chunk
+
+@app.on_event("startup")
+def prune_formula_images():
+    prune_formula_cache()
+
+@app.on_event("shutdown")
+def shutdown_pool():
+    _POOL.shutdown(wait=False, cancel_futures=True)
+
 # ----------- Error Handler -----------
 
 @app.exception_handler(Exception)
@@ -82,22 +135,50 @@ async def general_exception_handler(request: Request, exc: Exception):
 async def generate_paper(data: PaperData):
     try:
         validate_data(data)
-        word_bytes = generate_ieee_paper(data.dict())
-        
-        # Save the generated paper to the 'uploads' folder
+        missing = await run_in_threadpool(find_missing_files, [img.path for c in _iter_containers(data) for img in c.images or []])
+        if missing:
+            raise ValueError(f"Image file not found: {', '.join(missing)}")
+
+        # Empty default lists/strings are skipped; the generator reads them with .get()
+        payload = data.dict(exclude_defaults=True)
+
+        # One retry on a fresh pool if a worker died under this or an earlier request
+        for attempt in range(2):
+            pool = _POOL
+            try:
+                buffer = await build_paper(pool, payload)
+                break
+            except BrokenProcessPool:
+                _replace_broken_pool(pool)
+                if attempt:
+                    raise HTTPException(status_code=503, detail="Document generator is restarting, please retry.")
+
+        # Save the generated paper to the 'uploads' folder once the response is sent
         temp_file_path = os.path.join(upload_dir, "ieee_paper.docx")
-        with open(temp_file_path, "wb") as f:
-            f.write(word_bytes)
 
         return StreamingResponse(
-            BytesIO(word_bytes),
+            iter_chunks(buffer),
             media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            headers={"Content-Disposition": "attachment; filename=ieee_paper.docx"}
+            # .docx is already a ZIP; identity keeps GZipMiddleware from recompressing it
+            headers={"Content-Disposition": "attachment; filename=ieee_paper.docx", "Content-Encoding": "identity"},
+            background=BackgroundTask(save_bytes, temp_file_path, buffer.getbuffer())
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Error generating document")
         raise HTTPException(status_code=400, detail=str(e))
 
+async def build_paper(pool: ProcessPoolExecutor, payload: dict) -> BytesIO:
+    loop = asyncio.get_running_loop()
+
+    # Formulas are independent of the document build, so render them across the pool first
+    formulas = collect_formulas(payload)
+    images = await asyncio.gather(
+        *(loop.run_in_executor(pool, generate_latex_formula_image, f) for f in formulas)
+    )
+    return await loop.run_in_executor(pool, generate_ieee_paper, payload, dict(zip(formulas, images)))
+
 # ----------- Validation -----------
 
 def validate_data(data: PaperData):
@@ -126,34 +207,56 @@ def validate_data(data: PaperData):
             raise ValueError(f"Section {idx + 1} must have content or subsections")
 
         for img in section.images or []:
-            if not img.path.strip():
+            img.path = img.path.strip()
+            if not img.path:
                 raise ValueError(f"Image path is required in section '{section.heading}'")
 
-        if section.formulas:
-            section.formulas = [f for f in section.formulas if re.match(LATEX_PATTERN, f.strip())]
-
         for sub_idx, sub in enumerate(section.subsections or []):
             if not sub.heading.strip():
                 raise ValueError(f"Subsection {idx + 1}.{sub_idx + 1} is missing heading")
             if not sub.content.strip():
                 raise ValueError(f"Subsection {idx + 1}.{sub_idx + 1} is missing content")
             for img in sub.images or []:
-                if not img.path.strip():
+                img.path = img.path.strip()
+                if not img.path:
                     raise ValueError(f"Image path is required in subsection '{sub.heading}'")
-            if sub.formulas:
-                sub.formulas = [f for f in sub.formulas if re.match(LATEX_PATTERN, f.strip())] 
+
+    # Drop invalid LaTeX in one pass over every section and subsection
+    for container in _iter_containers(data):
+        if container.formulas:
+            container.formulas = list(filter(_LATEX_RE.match, map(str.strip, container.formulas)))
+
+def _iter_containers(data: PaperData):
+    for section in data.sections:
+        yield section
+        yield from section.subsections or []
+
+def find_missing_files(paths: List[str]) -> List[str]:
+    # Run in the threadpool: a slow or network-mounted uploads dir must not stall the loop
+    return [p for p in dict.fromkeys(paths) if not os.path.isfile(p)]
 
 # ----------- Image Upload Endpoint -----------
 
+# Formats python-docx can embed as-is; anything else is re-encoded to PNG
+DOCX_IMAGE_FORMATS = {"PNG", "JPEG", "GIF", "BMP", "TIFF"}
+
+def convert_to_png(contents: bytes, path: str):
+    Image.open(BytesIO(contents)).save(path, format="PNG")
+
 @app.post("/upload-image")
 async def upload_image(file: UploadFile = File(...)):
     try:
         contents = await file.read()
         image = Image.open(BytesIO(contents))
+        image_format = image.format
+        image.verify()  # header/checksum check only, no pixel decode
 
         # Save the image to the 'uploads' folder
         temp_file_path = os.path.join(upload_dir, file.filename)
-        image.save(temp_file_path, format="PNG")
+        if image_format in DOCX_IMAGE_FORMATS:
+            await run_in_threadpool(save_bytes, temp_file_path, contents)
+        else:
+            await run_in_threadpool(convert_to_png, contents, temp_file_path)
 
         return {
             "filename": file.filename,
@@ -172,11 +275,9 @@ async def check_plagiarism(file: UploadFile = File(...)):
         if not file.filename.endswith(".docx"):
             raise HTTPException(status_code=400, detail="Only .docx files are supported.")
 
-        temp_path = f"uploads/{file.filename}"
-        with open(temp_path, "wb") as f:
-            f.write(await file.read())
-
-        result = analyze_plagiarism(temp_path)
+        # Analyse straight from memory; the similarity model is CPU-bound, so keep it off the loop
+        contents = await file.read()
+        result = await run_in_threadpool(analyze_plagiarism, BytesIO(contents))
         return result
 
     except ValueError as e:
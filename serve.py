@@ -0,0 +1,20 @@
+import os
+import sys
+import uvicorn
+
+# Launcher kept apart from app.py: process-pool workers re-import the parent's
+# __main__, and app.py pulls in torch and the SentenceTransformer model
+
+if __name__ == "__main__":
+    # /generate's CPU work runs on each worker's process pool, which already
+    # spans the cores left over per worker; uvloop has no Windows build
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop="uvloop" if sys.platform != "win32" else "asyncio",
+        http="httptools",
+        limit_concurrency=1000,
+        timeout_keep_alive=30,
+    )
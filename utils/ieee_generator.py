@@ -1,20 +1,67 @@
+import hashlib
 import logging
+import os
 import re
 import tempfile
+import threading
+import time
+from functools import lru_cache
 from io import BytesIO
-import matplotlib.pyplot as plt
+from pathlib import Path
+from xml.sax.saxutils import escape
+from matplotlib import mathtext
+from matplotlib.figure import Figure
+from matplotlib.font_manager import FontProperties
 from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import nsdecls, qn
+from docx.oxml.shape import CT_Inline
 from docx.opc.constants import RELATIONSHIP_TYPE
 from docx.shared import Pt, Inches, RGBColor
 from docx.enum.text import WD_TAB_ALIGNMENT
 from docx.shared import Inches
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_MD_LINK_RE = re.compile(r'\[([^\]]+)\]\((https?://[^\)]+)\)')
+_LINK_RE = re.compile(r'\[([^\]]+)\]\((https?://[^\)]+)\)|(https?://[^\s]+)')
+_FOOTNOTE_RE = re.compile(r"\[\[footnote:(.*?)\]\]")
+# Body-text markup (citations + footnotes) matched together, so content is scanned once
+_CONTENT_RE = re.compile(f"{_MD_LINK_RE.pattern}|{_FOOTNOTE_RE.pattern}")
+_REF_NUMBER_RE = re.compile(r'^\[\d+\]\s*(.*)$')
+_RUN_BREAK_RE = re.compile(r'(\t|\r\n|\n|\r)')
+
+# Lengths/colours used per paragraph or per figure; python-docx treats them as immutable
+_IMG_W = Inches(3)
+_EQ_IMG_W = Inches(2.5)
+_EQ_IMG_COL_W = Inches(4.5)
+_EQ_NUM_COL_W = Inches(1.5)
+_TITLE_PT = Pt(16)
+_BLACK = RGBColor(0, 0, 0)
+_SPACE_BEFORE = Pt(8)
+_SPACE_AFTER = Pt(4)
+
+_FORMULA_FONT = FontProperties(size=14)
+_FORMULA_DPI = 150
+_FORMULA_MODE = "inline"  # formulas are always wrapped as $...$
+# Vector-layout parser, shared so its parse cache survives between formulas
+_MATHTEXT_PARSER = mathtext.MathTextParser('path')
+# One Figure (and its Agg canvas) reused for every formula; matplotlib objects
+# are not thread-safe, so drawing on it is serialised
+_FORMULA_FIG = Figure()
+_FORMULA_LOCK = threading.Lock()
+
+# Rendered formulas persist across runs, keyed by everything that affects the PNG
+_FORMULA_CACHE_DIR = Path(os.getenv("FORMULA_CACHE_DIR", Path.home() / ".cache" / "ieee_generator" / "formulas"))
+_FORMULA_CACHE_MAX_AGE = 30 * 24 * 3600
+# A temp file this old can't belong to a write still in progress
+_FORMULA_TMP_MAX_AGE = 3600
+
 
 def to_roman(num: int) -> str:
     roman_map = [
@@ -22,28 +69,109 @@ def to_roman(num: int) -> str:
         (100, 'C'), (90, 'XC'), (50, 'L'), (40, 'XL'),
         (10, 'X'), (9, 'IX'), (5, 'V'), (4, 'IV'), (1, 'I')
     ]
-    result = ""
+    parts = []
     for val, sym in roman_map:
-        while num >= val:
-            result += sym
-            num -= val
-    return result
+        count, num = divmod(num, val)
+        parts.append(sym * count)
+    return ''.join(parts)
+
+
+# Section numerals for any realistic paper, so headings index instead of recomputing
+_ROMAN = [to_roman(i) for i in range(256)]
 
 
-def generate_latex_formula_image(latex_code: str) -> str | None:
+def _formula_cache_path(latex_code: str) -> Path:
+    key = f"{latex_code}|{_FORMULA_FONT.get_size()}|{_FORMULA_DPI}|{_FORMULA_MODE}"
+    return _FORMULA_CACHE_DIR / f"{hashlib.sha1(key.encode()).hexdigest()}.png"
+
+
+def _cached_formula_png(latex_code: str, draw) -> bytes:
+    """Return the cached PNG for `latex_code`, rendering it with `draw` and storing it on a miss."""
+    path = _formula_cache_path(latex_code)
+    try:
+        png = path.read_bytes()
+    except OSError:
+        pass
+    else:
+        try:
+            os.utime(path)  # keep recently used entries out of the age-based prune
+        except OSError:
+            pass  # read-only/shared cache: the hit is still good
+        return png
+
+    png = draw(latex_code)
+    tmp_name = None
     try:
-        fig, ax = plt.subplots(figsize=(2, 0.5))
-        ax.text(0.5, 0.5, f"${latex_code}$", fontsize=14, ha='center', va='center')
-        ax.axis('off')
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-            plt.savefig(tmp.name, format='png', bbox_inches='tight', transparent=True)
-            plt.close(fig)
-            return tmp.name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as tmp:
+            tmp_name = tmp.name
+            tmp.write(png)
+        os.replace(tmp_name, path)  # atomic, so concurrent workers never read a partial file
+    except OSError as e:
+        logger.warning(f"Could not cache formula image: {e}")
+        if tmp_name:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+    return png
+
+
+def prune_formula_cache():
+    """
+    Delete cached formula PNGs unused for `_FORMULA_CACHE_MAX_AGE`, plus temp
+    files orphaned by a process that died mid-write; call once at app startup.
+    """
+    now = time.time()
+    for pattern, max_age in (("*.png", _FORMULA_CACHE_MAX_AGE), ("*.tmp", _FORMULA_TMP_MAX_AGE)):
+        for path in _FORMULA_CACHE_DIR.glob(pattern):
+            try:
+                if path.stat().st_mtime < now - max_age:
+                    path.unlink()
+            except OSError:
+                pass
+
+
+@lru_cache(maxsize=512)
+def _render_formula_png(latex_code: str) -> bytes:
+    return _cached_formula_png(latex_code, _draw_formula)
+
+
+def generate_latex_formula_image(latex_code: str) -> bytes | None:
+    try:
+        return _render_formula_png(latex_code)
     except Exception as e:
         logger.error(f"Formula rendering failed: {e}")
         return None
 
 
+def _draw_formula(latex_code: str) -> bytes:
+    """
+    Lay `latex_code` out with mathtext on the shared `_FORMULA_FIG` and return
+    PNG bytes: no pyplot, no temp files, no per-formula Figure, and no new
+    parser per call as math_to_image would create.
+    """
+    s = f"${latex_code}$"
+    buf = BytesIO()
+    with _FORMULA_LOCK:
+        width, height, depth, _, _ = _MATHTEXT_PARSER.parse(s, dpi=72, prop=_FORMULA_FONT)
+        _FORMULA_FIG.clear()
+        _FORMULA_FIG.set_size_inches(width / 72, height / 72)
+        _FORMULA_FIG.text(0, depth / height, s, fontproperties=_FORMULA_FONT)
+        _FORMULA_FIG.savefig(buf, dpi=_FORMULA_DPI, format='png')
+    return buf.getvalue()
+
+
+def collect_formulas(data: dict) -> list[str]:
+    """Every distinct formula in `data`, in document order."""
+    formulas = []
+    for sec_data in data['sections']:
+        formulas.extend(sec_data.get("formulas", []))
+        for sub in sec_data.get("subsections", []):
+            formulas.extend(sub.get("formulas", []))
+    return list(dict.fromkeys(formulas))
+
+
 def add_hyperlink(paragraph, display_text: str, url: str):
     """Insert a clickable, blue-underlined hyperlink into `paragraph`."""
     part = paragraph.part
@@ -78,51 +206,44 @@ def add_hyperlinks(paragraph, text: str):
     Scan `text` for markdown [text](url) or bare URLs, emit plain text and
     clickable hyperlinks.
     """
-    pattern = re.compile(r'\[([^\]]+)\]\((https?://[^\)]+)\)|(https?://[^\s]+)')
-    idx = 0
-    for m in pattern.finditer(text):
-        start, end = m.span()
-        if start > idx:
-            paragraph.add_run(text[idx:start])
-        if m.group(1) and m.group(2):
-            disp, url = m.group(1), m.group(2)
+    # split() yields [text, label, url, bare_url, text, label, url, bare_url, ..., text]
+    parts = _LINK_RE.split(text)
+    for i in range(0, len(parts) - 1, 4):
+        if parts[i]:
+            paragraph.add_run(parts[i])
+        label, url, bare = parts[i + 1:i + 4]
+        if url:
+            add_hyperlink(paragraph, label, url)
         else:
-            disp = url = m.group(3)
-        add_hyperlink(paragraph, disp, url)
-        idx = end
-    if idx < len(text):
-        paragraph.add_run(text[idx:])
+            add_hyperlink(paragraph, bare, bare)
+    if parts[-1]:
+        paragraph.add_run(parts[-1])
 
 
-def extract_and_replace_hyperlinks(text: str, start_idx: int = 1) -> tuple[str, list[str]]:
+def add_content(paragraph, text: str, start_idx: int = 1) -> list[str]:
     """
-    Replace every markdown [text](url) in `text` with [n], return modified
-    text and list of unique URLs found.
+    Add body `text` to `paragraph` in a single regex pass: every markdown
+    [text](url) becomes [n] and every [[footnote:Note text]] becomes
+    “[∗] Note text” inline. Returns the unique URLs cited, numbered from
+    `start_idx`.
     """
-    pattern = r'\[([^\]]+)\]\((https?://[^\)]+)\)'
     citations = []
     ref_map = {}
-    out = text
 
-    for match in re.finditer(pattern, text):
-        _, url = match.groups()
+    def _cite(url: str) -> str:
         if url not in ref_map:
             ref_map[url] = start_idx + len(citations)
             citations.append(url)
-        num = ref_map[url]
-        out = out.replace(match.group(0), f"[{num}]")
+        return f"[{ref_map[url]}]"
 
-    return out, citations
+    def _replace(match):
+        if match.group(2) is not None:
+            return _cite(match.group(2))
+        # links inside a footnote are still numbered, in reading order
+        return "[*] " + _MD_LINK_RE.sub(lambda m: _cite(m.group(2)), match.group(3))
 
-
-def insert_footnotes(paragraph, content: str):
-    """
-    Replace [[footnote:Note text]] with “[∗] Note text” inline.
-    """
-    pattern = r"\[\[footnote:(.*?)\]\]"
-    for note in re.findall(pattern, content):
-        content = content.replace(f"[[footnote:{note}]]", f"[*] {note}")
-    paragraph.add_run(content)
+    paragraph.add_run(_CONTENT_RE.sub(_replace, text))
+    return citations
 
 
 def set_single_column_layout(section):
@@ -143,17 +264,17 @@ def set_ieee_column_layout(section):
     cols.set(qn('w:space'), '720')
     sectPr.append(cols)
 
-def insert_equation(doc, image_path: str, eq_number: int):
+def insert_equation(doc, image_png: bytes, eq_number: int):
     table = doc.add_table(rows=1, cols=2)
     table.allow_autofit = True
-    table.columns[0].width = Inches(4.5)
-    table.columns[1].width = Inches(1.5)
+    table.columns[0].width = _EQ_IMG_COL_W
+    table.columns[1].width = _EQ_NUM_COL_W
 
     # Insert image in left cell
     cell_img = table.cell(0, 0)
     paragraph_img = cell_img.paragraphs[0]
     run_img = paragraph_img.add_run()
-    run_img.add_picture(image_path, width=Inches(2.5))
+    run_img.add_picture(BytesIO(image_png), width=_EQ_IMG_W)
     paragraph_img.alignment = WD_ALIGN_PARAGRAPH.LEFT
 
     # Insert number in right cell
@@ -163,53 +284,159 @@ def insert_equation(doc, image_path: str, eq_number: int):
     paragraph_num.add_run(f"({eq_number})")
 
 
-def format_Subheading(paragraph):
-    run = paragraph.runs[0]
-    run.bold = False
-    run.font.color.rgb = RGBColor(0, 0, 0)
-    paragraph.paragraph_format.space_before = Pt(8)
-    paragraph.paragraph_format.space_after = Pt(4)
+def add_para(doc, text: str = "", style: str | None = None) -> Paragraph:
+    """
+    Append a `w:p` built directly in OXML. `doc.add_paragraph` scans the body's
+    children for the trailing sectPr and resolves the style name through
+    styles.xml on every call; here the sectPr is taken as the body's last
+    child and `style` is written straight in as the style id (the IEEE*
+    styles' ids equal their names).
+    """
+    p = OxmlElement('w:p')
+    if style:
+        p.get_or_add_pPr().style = style
+    if text:
+        p.add_r().text = text
+    doc.element.body[-1].addprevious(p)  # keep w:sectPr last
+    return Paragraph(p, doc._body)
 
-def format_heading(paragraph):
-    run = paragraph.runs[0]
-    run.bold = False
-    run.font.color.rgb = RGBColor(0, 0, 0)
-    paragraph.paragraph_format.space_before = Pt(8)
-    paragraph.paragraph_format.space_after = Pt(4)
-    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+def add_figure(doc, path: str, caption: str, fig_no: int, image_cache: dict):
+    """
+    Insert the image at `path` plus its caption. A path seen before reuses the
+    already-related image part, so figures repeated across sections are read
+    and parsed once and point at the same media.
+    """
+    if path not in image_cache:
+        image_cache[path] = doc.part.get_or_add_image(path)
+    r_id, image = image_cache[path]
+
+    cx, cy = image.scaled_dimensions(_IMG_W, None)
+    inline = CT_Inline.new_pic_inline(doc.part.next_id, r_id, image.filename, cx, cy)
+    add_para(doc).add_run()._r.add_drawing(inline)
+    add_para(doc, f"Fig. {fig_no}: {caption}", style='IEEECaption')
+
+
+def _run_xml(text: str) -> str:
+    """`<w:r>` markup for `text`, with tabs and line breaks as `<w:tab/>`/`<w:br/>` like `CT_R.text`."""
+    parts = []
+    for piece in _RUN_BREAK_RE.split(text):
+        if piece == "\t":
+            parts.append("<w:tab/>")
+        elif piece in ("\r\n", "\n", "\r"):
+            parts.append("<w:br/>")
+        elif piece:
+            parts.append(f'<w:t xml:space="preserve">{escape(piece)}</w:t>')
+    return f"<w:r>{''.join(parts)}</w:r>"
+
+
+def add_data_table(doc, rows: list[list]) -> Table:
+    """
+    Build the whole <w:tbl>, style reference included, as one XML string and
+    parse it once, instead of filling cells one `table.cell(r, c).text` lookup
+    at a time. Rows shorter than the longest one are padded with empty cells.
+    """
+    n_cols = max(map(len, rows))
+    sec = doc.sections[-1]
+    col_w = int((sec.page_width - sec.left_margin - sec.right_margin) / n_cols / 635)  # EMU -> twips
+    tc_pr = f'<w:tcPr><w:tcW w:type="dxa" w:w="{col_w}"/></w:tcPr>'
+
+    grid = f'<w:gridCol w:w="{col_w}"/>' * n_cols
+    body = "".join(
+        "<w:tr>" + "".join(
+            f'<w:tc>{tc_pr}<w:p>{_run_xml(str(val))}</w:p></w:tc>'
+            for val in list(row) + [""] * (n_cols - len(row))
+        ) + "</w:tr>"
+        for row in rows
+    )
+    tbl = parse_xml(
+        f'<w:tbl {nsdecls("w")}>'
+        # "Table Grid" ships in python-docx's default template under this style id
+        '<w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:type="auto" w:w="0"/>'
+        '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" '
+        'w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr>'
+        f'<w:tblGrid>{grid}</w:tblGrid>{body}</w:tbl>'
+    )
+    doc.element.body._insert_tbl(tbl)
+    return Table(tbl, doc._body)
+
+
+def add_ieee_styles(doc):
+    """
+    Register the paragraph styles the generator uses, so each paragraph only
+    references a style instead of having its formatting set one property at a time.
+    """
+    styles = doc.styles
+
+    body = styles.add_style('IEEEBody', WD_STYLE_TYPE.PARAGRAPH)
+    body.base_style = styles['Normal']
+    body.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+
+    caption = styles.add_style('IEEECaption', WD_STYLE_TYPE.PARAGRAPH)
+    caption.base_style = styles['Normal']
+    caption.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    subheading = styles.add_style('IEEESubheading', WD_STYLE_TYPE.PARAGRAPH)
+    subheading.base_style = styles['Normal']
+    subheading.font.bold = False
+    subheading.font.color.rgb = _BLACK
+    subheading.paragraph_format.space_before = _SPACE_BEFORE
+    subheading.paragraph_format.space_after = _SPACE_AFTER
+
+    heading = styles.add_style('IEEEHeading', WD_STYLE_TYPE.PARAGRAPH)
+    heading.base_style = subheading
+    heading.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
 
 def italic_format_heading(paragraph):
     run = paragraph.runs[0]
     run.italic = True
     run.bold = True
-    run.font.color.rgb = RGBColor(0, 0, 0)
-    paragraph.paragraph_format.space_before = Pt(8)
-    paragraph.paragraph_format.space_after = Pt(4)
+    run.font.color.rgb = _BLACK
+    paragraph.paragraph_format.space_before = _SPACE_BEFORE
+    paragraph.paragraph_format.space_after = _SPACE_AFTER
 
-def generate_ieee_paper(data: dict) -> bytes:
+def _build_template() -> bytes:
+    """Page setup and styles shared by every paper, serialised once at import."""
+    doc = Document()
+
+    # ——— Global style ——————————————————————————————
+    normal = doc.styles['Normal']
+    normal.font.name = 'Times New Roman'
+    normal.font.size = Pt(10)
+    add_ieee_styles(doc)
+
+    sec = doc.sections[0]
+    sec.page_width = Inches(8.5)
+    sec.page_height = Inches(11)
+    sec.left_margin = Inches(0.75)
+    sec.right_margin = Inches(0.75)
+    sec.top_margin = Inches(1.0)
+    sec.bottom_margin = Inches(1.0)
+    set_single_column_layout(sec)
+
+    out = BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+_TEMPLATE_BYTES = _build_template()
+
+
+def generate_ieee_paper(data: dict, formula_images: dict[str, bytes | None] | None = None) -> BytesIO:
+    """
+    Build the IEEE docx for `data`. `formula_images` maps formula text to
+    pre-rendered PNG bytes (see `collect_formulas`); anything missing is
+    rendered here before the document walk.
+    """
     try:
-        doc = Document()
-
-        # ——— Global style ——————————————————————————————
-        normal = doc.styles['Normal']
-        normal.font.name = 'Times New Roman'
-        normal.font.size = Pt(10)
-
-        sec = doc.sections[0]
-        sec.page_width = Inches(8.5)
-        sec.page_height = Inches(11)
-        sec.left_margin = Inches(0.75)
-        sec.right_margin = Inches(0.75)
-        sec.top_margin = Inches(1.0)
-        sec.bottom_margin = Inches(1.0)
-        set_single_column_layout(sec)
+        doc = Document(BytesIO(_TEMPLATE_BYTES))
 
         # ——— Title & Authors ——————————————————————————————
         t = doc.add_paragraph()
         t.alignment = WD_ALIGN_PARAGRAPH.CENTER
         r = t.add_run(data['title'].upper())
         r.bold = True
-        r.font.size = Pt(16)
+        r.font.size = _TITLE_PT
 
         for line in (
             ", ".join(data['authors']),
@@ -226,16 +453,12 @@ def generate_ieee_paper(data: dict) -> bytes:
         # ——— Abstract ——————————————————————————————
         italic_format_heading(doc.add_paragraph("Abstract—"))
         abs_text = " ".join(data['abstract']) if isinstance(data['abstract'], list) else data['abstract']
-        for para in abs_text.split('\n'):
-            p = doc.add_paragraph(para)
-            p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-            for run in p.runs:
-                run.bold = True
+        for line in abs_text.splitlines():
+            add_para(doc, style='IEEEBody').add_run(line).bold = True
 
         # ——— Keywords ——————————————————————————————
-        format_Subheading(doc.add_paragraph("Keywords"))
-        kw = doc.add_paragraph(", ".join(data['keywords']))
-        kw.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+        add_para(doc, "Keywords", style='IEEESubheading')
+        add_para(doc, ", ".join(data['keywords']), style='IEEEBody')
 
         # ——— Main Sections ——————————————————————————————
         fig_ct = tbl_ct = 1
@@ -243,43 +466,41 @@ def generate_ieee_paper(data: dict) -> bytes:
         extracted = []
         equation_counter = 1
 
+        image_cache = {}
+
+        formula_images = dict(formula_images or {})
+        for formula in collect_formulas(data):
+            if formula not in formula_images:
+                formula_images[formula] = generate_latex_formula_image(formula)
+
         for i, sec_data in enumerate(data['sections'], 1):
-            roman = to_roman(i)
-            format_heading(doc.add_paragraph(f"{roman}. {sec_data['heading'].upper()}"))
+            roman = _ROMAN[i] if i < len(_ROMAN) else to_roman(i)
+            add_para(doc, f"{roman}. {sec_data['heading'].upper()}", style='IEEEHeading')
 
             # Content + citations
             content = sec_data.get("content", "").strip()
             if content:
-                p = doc.add_paragraph()
-                p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                mod, urls = extract_and_replace_hyperlinks(content, ref_idx)
-                insert_footnotes(p, mod)
-                p_runs = p.runs  # text now has "[n]" placeholders; no inline links per IEEE
+                p = add_para(doc, style='IEEEBody')
+                urls = add_content(p, content, ref_idx)  # "[n]" placeholders; no inline links per IEEE
                 ref_idx += len(urls)
                 extracted.extend(urls)
 
             # Images
             for img in sec_data.get("images", []):
-                doc.add_picture(img["path"], width=Inches(3))
-                cap = doc.add_paragraph(f"Fig. {fig_ct}: {img['caption']}")
-                cap.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                add_figure(doc, img["path"], img["caption"], fig_ct, image_cache)
                 fig_ct += 1
 
             # Tables
             for table in sec_data.get("tables", []):
-                tbl = doc.add_table(rows=len(table), cols=len(table[0]))
-                tbl.style = "Table Grid"
-                for r, row in enumerate(table):
-                    for c, val in enumerate(row):
-                        tbl.cell(r, c).text = str(val)
-                doc.add_paragraph(f"Table {tbl_ct}: Data Table").alignment = WD_ALIGN_PARAGRAPH.CENTER
+                add_data_table(doc, table)
+                add_para(doc, f"Table {tbl_ct}: Data Table", style='IEEECaption')
                 tbl_ct += 1
 
             # Formulas
             for f_i, formula in enumerate(sec_data.get("formulas", []), 1):
-                path = generate_latex_formula_image(formula)
-                if path:
-                        insert_equation(doc, path, equation_counter)
+                png = formula_images[formula]
+                if png:
+                        insert_equation(doc, png, equation_counter)
                         equation_counter += 1
                         #doc.add_picture(path, width=Inches(2))
                         #cap = doc.add_paragraph(f"Equation {roman}.{j}.{f_i}: {formula}")
@@ -287,36 +508,29 @@ def generate_ieee_paper(data: dict) -> bytes:
 
             # Subsections
             for j, sub in enumerate(sec_data.get("subsections", []), 1):
-                format_Subheading(doc.add_paragraph(f"{chr(64+j)}. {sub['heading']}"))
+                letter = chr(64 + j)
+                add_para(doc, f"{letter}. {sub['heading']}", style='IEEESubheading')
 
                 cnt = sub.get("content", "").strip()
                 if cnt:
-                    p = doc.add_paragraph()
-                    p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                    mod, urls = extract_and_replace_hyperlinks(cnt, ref_idx)
-                    insert_footnotes(p, mod)
+                    p = add_para(doc, style='IEEEBody')
+                    urls = add_content(p, cnt, ref_idx)
                     ref_idx += len(urls)
                     extracted.extend(urls)
 
                 for img in sub.get("images", []):
-                    doc.add_picture(img["path"], width=Inches(3))
-                    cap = doc.add_paragraph(f"Fig. {fig_ct}: {img['caption']}")
-                    cap.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                    add_figure(doc, img["path"], img["caption"], fig_ct, image_cache)
                     fig_ct += 1
 
                 for table in sub.get("tables", []):
-                    tbl = doc.add_table(rows=len(table), cols=len(table[0]))
-                    tbl.style = "Table Grid"
-                    for r, row in enumerate(table):
-                        for c, val in enumerate(row):
-                            tbl.cell(r, c).text = str(val)
-                    doc.add_paragraph(f"Table {tbl_ct}: Data Table").alignment = WD_ALIGN_PARAGRAPH.CENTER
+                    add_data_table(doc, table)
+                    add_para(doc, f"Table {tbl_ct}: Data Table", style='IEEECaption')
                     tbl_ct += 1
 
                 for f_i, formula in enumerate(sub.get("formulas", []), 1):
-                    path = generate_latex_formula_image(formula)
-                    if path:
-                        insert_equation(doc, path, equation_counter)
+                    png = formula_images[formula]
+                    if png:
+                        insert_equation(doc, png, equation_counter)
                         equation_counter += 1
                         #doc.add_picture(path, width=Inches(2))
                         #cap = doc.add_paragraph(f"Equation {roman}.{j}.{f_i}: {formula}")
@@ -326,7 +540,7 @@ def generate_ieee_paper(data: dict) -> bytes:
         # Strip leading [n] from manual refs
         manual = []
         for r in data.get('references', []):
-            m = re.match(r'^\[\d+\]\s*(.*)$', r)
+            m = _REF_NUMBER_RE.match(r)
             manual.append(m.group(1) if m else r)
 
         # Dedupe extracted
@@ -335,25 +549,23 @@ def generate_ieee_paper(data: dict) -> bytes:
 
         combined = manual + [f"[Online]. Available: {u}" for u in filtered]
 
-        format_heading(doc.add_paragraph("REFERENCES"))
+        add_para(doc, "REFERENCES", style='IEEEHeading')
         for idx, ref in enumerate(combined, 1):
-            p = doc.add_paragraph()
-            p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+            p = add_para(doc, style='IEEEBody')
             # Number + hyperlink any URLs
             add_hyperlinks(p, f"[{idx}] {ref}")
 
         # ——— Appendix ——————————————————————————————
         if data.get('appendix'):
-            format_heading(doc.add_paragraph("Appendix"))
+            add_para(doc, "Appendix", style='IEEEHeading')
             for item in data['appendix']:
-                p = doc.add_paragraph(item)
-                p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+                add_para(doc, item, style='IEEEBody')
 
         # ——— Write out ——————————————————————————————
         out = BytesIO()
         doc.save(out)
         out.seek(0)
-        return out.read()
+        return out
 
     except Exception as e:
         logger.error(f"Error generating IEEE paper: {e}")
@@ -1,25 +1,37 @@
 from importlib.metadata import PackageNotFoundError
+import copy
 import os
 import re
 import torch
 import logging
 import docx
-from sklearn.metrics.pairwise import cosine_similarity
+from functools import lru_cache
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict
+from typing import BinaryIO, List, Dict, Union
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-model = SentenceTransformer('all-MiniLM-L6-v2')  # Light, fast BERT model
+device = "cuda" if torch.cuda.is_available() else "cpu"
+model = SentenceTransformer('all-MiniLM-L6-v2', device=device)  # Light, fast BERT model
+if device == "cuda":
+    model.half()  # FP16 forward pass: faster encode, half the memory traffic
 
-def extract_text_from_docx(file_path):
+# encode() already sorts inputs by length before batching, so each batch pads
+# only to its own longest sentence; the batch size is the remaining knob
+ENCODE_BATCH_SIZE = 64
+# Rows of the similarity matrix computed per matmul (bounds memory at block x n)
+SIMILARITY_BLOCK_ROWS = 1024
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+_CITATION_RE = re.compile(r"\[(\d+)\]")
+
+def extract_text_from_docx(docx_file: Union[str, BinaryIO]):
     try:
-        document = docx.Document(file_path)
-        full_text = []
-        for para in document.paragraphs:
-            full_text.append(para.text)
-        return "\n".join(full_text)
+        document = docx.Document(docx_file)
+        # join() materialises its input anyway, so a lazy paragraph walk would save nothing
+        return "\n".join([para.text for para in document.paragraphs])
     except PackageNotFoundError:
         logger.error("The uploaded file is not a valid .docx file.")
         raise ValueError("The uploaded file is not a valid .docx file. Please upload a proper Word document.")
@@ -28,57 +40,103 @@ def extract_text_from_docx(file_path):
         raise ValueError(f"Error reading document: {str(e)}")
 
 def split_into_sentences(text: str) -> List[str]:
-    # Basic sentence splitting (you can improve with SpaCy/NLTK)
-    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
-    return [s.strip() for s in sentences if s.strip()]
+    # Basic sentence splitting (you can improve with SpaCy/NLTK).
+    # The split consumes all whitespace at each boundary and the text is stripped,
+    # so pieces are already trimmed; only the empty result of "" needs dropping.
+    return list(filter(None, _SENTENCE_SPLIT_RE.split(text.strip())))
 
 def extract_references(text: str) -> List[str]:
-    # Extract references block based on "References" section
-    if "references" not in text.lower():
+    # Extract references block based on the last "References" heading; lower-case once, no full split
+    lowered = text.lower()
+    idx = lowered.rfind("references")
+    if idx == -1:
         return []
-    refs = text.lower().split("references")[-1]
-    return split_into_sentences(refs)
+    return split_into_sentences(lowered[idx + len("references"):])
 
 def check_citations(text: str, references: List[str]) -> Dict[str, bool]:
-    citation_pattern = r"\[(\d+)\]"
-    found = re.findall(citation_pattern, text)
+    found = _CITATION_RE.findall(text)
     ref_map = {str(i+1): ref for i, ref in enumerate(references)}
     citation_check = {}
     for c in found:
         citation_check[f"[{c}]"] = c in ref_map
     return citation_check
 
+def dedupe_sentences(sentences: List[str]):
+    """
+    Collapse sentences that differ only in case/whitespace (repeated headers,
+    boilerplate). Returns the distinct sentences and, per input sentence, the
+    index of its distinct representative.
+    """
+    slots = {}
+    unique, inverse = [], []
+    for sentence in sentences:
+        key = _WHITESPACE_RE.sub(' ', sentence).lower()
+        if key not in slots:
+            slots[key] = len(unique)
+            unique.append(sentence)
+        inverse.append(slots[key])
+    return unique, inverse
+
 def compute_semantic_similarity(sentences: List[str], threshold: float = 0.85) -> List[Dict]:
-    embeddings = model.encode(sentences, convert_to_tensor=True)
-    sims = cosine_similarity(embeddings.cpu(), embeddings.cpu())
-    
-    flagged = []
-    for i in range(len(sentences)):
-        for j in range(i+1, len(sentences)):
-            if sims[i][j] > threshold:
-                flagged.append({
-                    "sentence_1": sentences[i],
-                    "sentence_2": sentences[j],
-                    "similarity": float(sims[i][j])
-                })
-    return flagged
-
-def analyze_plagiarism(docx_path: str, threshold: float = 0.85) -> Dict:
+    if len(sentences) < 2:
+        return []
+    unique, inverse = dedupe_sentences(sentences)
+    with torch.inference_mode():
+        # Unit-length embeddings, so a plain matmul on the encode device gives cosine similarity
+        embeddings = model.encode(
+            unique, convert_to_tensor=True, normalize_embeddings=True,
+            batch_size=ENCODE_BATCH_SIZE, show_progress_bar=False
+        )
+        # Fan back out to one row per input sentence; duplicates still pair up at ~1.0
+        embeddings = embeddings[torch.tensor(inverse, device=embeddings.device)]
+
+        # The matrix is symmetric, so each row block is only multiplied against
+        # columns from its own start onwards: about half the FLOPs of a full
+        # emb @ emb.T, and never an n x n matrix in memory. (util.paraphrase_mining_embeddings
+        # is not used: its top_k/max_pairs caps drop pairs above threshold, and it
+        # ranks every candidate through a Python priority queue before thresholding.)
+        rows, cols, scores = [], [], []
+        for start in range(0, len(embeddings), SIMILARITY_BLOCK_ROWS):
+            block = embeddings[start:start + SIMILARITY_BLOCK_ROWS] @ embeddings[start:].T
+            r, c = torch.triu(block > threshold, diagonal=1).nonzero(as_tuple=True)
+            rows.append(r + start)
+            cols.append(c + start)
+            scores.append(block[r, c].float())
+
+        # Pairs i < j above threshold, in row-major order; only the hits leave the device
+        ii, jj = torch.cat(rows).cpu().tolist(), torch.cat(cols).cpu().tolist()
+        vals = torch.cat(scores).cpu().tolist()
+
+    return [
+        {"sentence_1": sentences[i], "sentence_2": sentences[j], "similarity": v}
+        for i, j, v in zip(ii, jj, vals)
+    ]
+
+# Bounded by entry count, not bytes: each entry holds the document text plus every
+# flagged pair, which boilerplate-heavy papers can make large, so keep only a few
+@lru_cache(maxsize=8)
+def _analyze_text(text: str, threshold: float) -> Dict:
+    # Keyed on the extracted text, so re-checking the same paper (re-uploads,
+    # retries) skips the encode and pair mining entirely
+    sentences = split_into_sentences(text)
+    references = extract_references(text)
+    citations = check_citations(text, references)
+    logger.info("Performing semantic analysis...")
+    similar_pairs = compute_semantic_similarity(sentences, threshold)
+
+    return {
+        "total_sentences": len(sentences),
+        "citation_validation": citations,
+        "similar_sentences": similar_pairs,
+        "plagiarism_score": round(len(similar_pairs) / max(1, len(sentences)), 2)
+    }
+
+def analyze_plagiarism(docx_file: Union[str, BinaryIO], threshold: float = 0.85) -> Dict:
     try:
         logger.info("Extracting text...")
-        text = extract_text_from_docx(docx_path)
-        sentences = split_into_sentences(text)
-        references = extract_references(text)
-        citations = check_citations(text, references)
-        logger.info("Performing semantic analysis...")
-        similar_pairs = compute_semantic_similarity(sentences, threshold)
-
-        return {
-            "total_sentences": len(sentences),
-            "citation_validation": citations,
-            "similar_sentences": similar_pairs,
-            "plagiarism_score": round(len(similar_pairs) / max(1, len(sentences)), 2)
-        }
+        text = extract_text_from_docx(docx_file)
+        # Deep copy: the pair dicts and citation map are otherwise shared with the cache entry
+        return copy.deepcopy(_analyze_text(text, threshold))
 
     except Exception as e:
         logger.error(f"Plagiarism analysis failed: {e}")